@@ -14,18 +14,26 @@ working even if the site's markup receives minor adjustments.
 from __future__ import annotations
 
 import argparse
+import hashlib
 import itertools
+import json
 import os
 import re
+import shutil
 import sys
+import threading
 import time
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, List, Sequence, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
 from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 BASE_URL = "https://cpclube.cpc.com.tw/"
 CATALOG_URL = "https://cpclube.cpc.com.tw/C_Products.aspx?n=7464&sms=12326&_CSN=0"
@@ -37,6 +45,14 @@ DEFAULT_CATEGORIES = [
     "基礎油",
 ]
 IMG_NAME_PATTERN = re.compile(r"[^0-9A-Za-z\-._]+")
+PRODUCT_LINK_PATTERN = re.compile(r"C_Products_Detail")
+# Each page type only needs one kind of tag, so parse just that subtree.
+ANCHOR_STRAINER = SoupStrainer("a", href=True)
+IMAGE_STRAINER = SoupStrainer("img", src=True)
+DEFAULT_WORKERS = 8
+DEFAULT_RATE_LIMIT = 4.0
+CACHE_FILENAME = "cache.json"
+STORE_DIRNAME = "store_by_hash"
 
 
 @dataclass
@@ -48,9 +64,240 @@ class DownloadResult:
     skipped: int
 
 
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` requests per second overall.
+
+    Unlike a fixed sleep after each request, callers only wait when they
+    actually run ahead of the budget, so slow responses do not add idle time
+    and bursts from parallel workers are still capped.  A rate of ``0``
+    disables throttling.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ValidatorCache:
+    """ETag / Last-Modified validators of downloaded images.
+
+    Entries are keyed by URL and then by destination, because one image URL
+    is saved into every product folder that shows it and each copy has to be
+    revalidated on its own.  The cache lives in a JSON file under the output
+    folder.  Entries are only used for conditional requests while the
+    recorded file still exists, and the file is rewritten atomically through
+    a temporary file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Validators seen for each URL during this run, handed to copies that
+        # are linked from the image store instead of downloaded.
+        self._latest: Dict[str, Dict[str, str]] = {}
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            entries = {}
+        self.entries: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for url, entry in entries.items():
+            if "path" in entry:
+                # Older caches kept a single copy per URL.
+                entry = {entry["path"]: {key: entry.get(key, "") for key in ("etag", "last_modified")}}
+            self.entries[url] = entry
+
+    def conditional_headers(self, url: str, destination: Path) -> Dict[str, str]:
+        with self.lock:
+            entry = self.entries.get(url, {}).get(str(destination))
+        if not entry or not destination.exists():
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, url: str, headers: Mapping[str, str], destination: Path) -> None:
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        validators = {"etag": etag or "", "last_modified": last_modified or ""}
+        with self.lock:
+            self._latest[url] = validators
+            self.entries.setdefault(url, {})[str(destination)] = validators
+
+    def share(self, url: str, destination: Path) -> None:
+        """Give ``destination`` the validators recorded for ``url`` this run."""
+
+        with self.lock:
+            validators = self._latest.get(url)
+            if validators:
+                self.entries.setdefault(url, {})[str(destination)] = validators
+
+    def save(self) -> None:
+        with self.lock:
+            data = json.dumps(self.entries, ensure_ascii=False, indent=2)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text(data, encoding="utf-8")
+        os.replace(temporary, self.path)
+
+
+def _create_partial(destination: Path) -> Tuple[int, Path]:
+    """Create a new, uniquely named ``.part`` file beside ``destination``.
+
+    Opening with mode 0o666 leaves the final permissions to the umask, as a
+    plain ``open()`` would, where ``tempfile.mkstemp`` would make them 0600.
+    """
+
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        partial = destination.with_name(f"{destination.name}.{os.urandom(4).hex()}.part")
+        try:
+            return os.open(partial, flags, 0o666), partial
+        except FileExistsError:
+            continue
+
+
+def _check_length(url: str, headers: Mapping[str, str], written: int) -> None:
+    """Reject a body shorter than its Content-Length.
+
+    urllib3 2 raises on a cut-off transfer, but urllib3 1.26 simply ends the
+    stream, which would otherwise publish a truncated image for good.  The
+    length only describes the written bytes when no content coding applies.
+    """
+
+    expected = headers.get("Content-Length")
+    if not expected or headers.get("Content-Encoding", "identity") != "identity":
+        return
+    if int(expected) != written:
+        raise IOError(f"incomplete body for {url}: {written} of {expected} bytes")
+
+
+class _HashingWriter:
+    """File wrapper that feeds every written chunk into a SHA-1 digest."""
+
+    def __init__(self, handle: BinaryIO, digest: hashlib._Hash):
+        self.handle = handle
+        self.digest = digest
+
+    def write(self, chunk: bytes) -> int:
+        self.digest.update(chunk)
+        return self.handle.write(chunk)
+
+
+class ImageStore:
+    """Content-addressed copy of every downloaded image.
+
+    Each distinct image body is kept once as ``<root>/<sha1[:2]>/<sha1><ext>``
+    and product folders hold hard links to it, so an image shared by several
+    products only occupies disk space once.  URLs resolved during this run are
+    remembered, letting later products link aliased images without another
+    request.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.lock = threading.Lock()
+        self.by_url: Dict[str, Path] = {}
+        self._listings: Dict[str, Set[str]] = {}
+
+    def lookup(self, url: str) -> Optional[Path]:
+        with self.lock:
+            return self.by_url.get(url)
+
+    def adopt(self, url: str, destination: Path, digest: str) -> None:
+        """Register a freshly written ``destination`` whose body hashes to ``digest``."""
+
+        stored = self.root / digest[:2] / f"{digest}{destination.suffix}"
+        with self.lock:
+            listing = self._listing(stored.parent)
+            try:
+                if stored.name in listing:
+                    self._link_into(stored, destination)
+                else:
+                    os.link(destination, stored)
+                    listing.add(stored.name)
+            except OSError:
+                # Hard links are unsupported here (e.g. FAT or a different
+                # device); keep the product copy and skip deduplication.
+                return
+            self.by_url[url] = stored
+
+    def link(self, stored: Path, destination: Path) -> None:
+        with self.lock:
+            self._link_into(stored, destination)
+
+    def _listing(self, directory: Path) -> Set[str]:
+        """Names in a prefix directory, read with one scandir per run."""
+
+        listing = self._listings.get(directory.name)
+        if listing is None:
+            directory.mkdir(parents=True, exist_ok=True)
+            listing = {entry.name for entry in os.scandir(directory)}
+            self._listings[directory.name] = listing
+        return listing
+
+    @staticmethod
+    def _link_into(stored: Path, destination: Path) -> None:
+        temporary = destination.with_name(destination.name + ".link")
+        if temporary.exists():
+            temporary.unlink()
+        os.link(stored, temporary)
+        os.replace(temporary, destination)
+
+
 class CPCScraper:
-    def __init__(self, delay: float = 0.5, retries: int = 3, timeout: int = 15):
+    def __init__(
+        self,
+        rate_limit: float = DEFAULT_RATE_LIMIT,
+        retries: int = 3,
+        timeout: int = 15,
+        workers: int = DEFAULT_WORKERS,
+    ):
+        # requests already negotiates gzip/deflate and adds brotli ("br") to
+        # Accept-Encoding when the brotli package is installed, which shrinks
+        # the WebForms HTML considerably over the wire.
         self.session = requests.Session()
+        # Size the connection pool for the page and image worker threads so
+        # sockets are reused instead of being dropped with "Connection pool is
+        # full", and let urllib3 retry transient failures with exponential
+        # backoff.
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=max(2 * workers, 32),
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=0.5,
+                status_forcelist={429, 500, 502, 503, 504},
+                respect_retry_after_header=True,
+                allowed_methods={"GET", "HEAD"},
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update(
             {
                 "User-Agent": (
@@ -60,46 +307,99 @@ class CPCScraper:
                 )
             }
         )
-        self.delay = delay
+        self.limiter = RateLimiter(rate_limit)
+        self._soups: Dict[Tuple[str, Optional[SoupStrainer]], BeautifulSoup] = {}
+        self._soup_lock = threading.Lock()
         self.retries = retries
         self.timeout = timeout
 
     # ------------------------------------------------------------------
     # HTTP helpers
     def get_text(self, url: str) -> str:
-        for attempt in range(1, self.retries + 1):
-            try:
-                response = self.session.get(url, timeout=self.timeout)
-                response.raise_for_status()
-                return response.text
-            except requests.RequestException as exc:  # pragma: no cover - network error
-                if attempt == self.retries:
-                    raise
-                backoff = self.delay * attempt
-                print(f"Request failed ({exc}), retrying in {backoff:.1f}s", file=sys.stderr)
-                time.sleep(backoff)
-        raise RuntimeError("unreachable")
-
-    def get_binary(self, url: str) -> bytes:
-        for attempt in range(1, self.retries + 1):
+        self.limiter.acquire()
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def get_binary(
+        self, url: str, destination: Path, cache: Optional[ValidatorCache] = None
+    ) -> Optional[str]:
+        """Stream ``url`` into ``destination`` without buffering the whole body.
+
+        The body is written to a uniquely named ``.part`` file in the same
+        folder and renamed into place once complete, so an interrupted
+        download is never mistaken for an existing image on the next run and
+        two downloads aimed at the same name never share a temporary file.
+        Returns the SHA-1 hex digest of the body.  When ``cache`` holds
+        validators for the image the request is conditional, and ``None`` is
+        returned if the server answers 304 Not Modified and the file was left
+        untouched.
+        """
+
+        self.limiter.acquire()
+        headers = cache.conditional_headers(url, destination) if cache else {}
+        digest = hashlib.sha1()
+        fd, partial = _create_partial(destination)
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                with self.session.get(
+                    url, timeout=self.timeout, stream=True, headers=headers
+                ) as response:
+                    if response.status_code == 304:
+                        return None
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    shutil.copyfileobj(response.raw, _HashingWriter(handle, digest), length=65536)
+                    _check_length(url, response.headers, handle.tell())
+            os.replace(partial, destination)
+        finally:
+            # Leftover only on 304 or failure; after os.replace it is gone.
             try:
-                response = self.session.get(url, timeout=self.timeout)
-                response.raise_for_status()
-                return response.content
-            except requests.RequestException as exc:  # pragma: no cover - network error
-                if attempt == self.retries:
-                    raise
-                backoff = self.delay * attempt
-                print(f"Image request failed ({exc}), retrying in {backoff:.1f}s", file=sys.stderr)
-                time.sleep(backoff)
-        raise RuntimeError("unreachable")
+                os.unlink(partial)
+            except FileNotFoundError:
+                pass
+        if cache:
+            cache.record(url, response.headers, destination)
+        return digest.hexdigest()
+
+    def get_soup(self, url: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+        """Fetch and parse ``url``, reusing the parsed page for repeat URLs.
+
+        Products that belong to several categories share one detail page, so
+        caching on the URL saves both the request and the parse.
+        ``parse_only`` limits the tree to the tags the caller needs and is
+        part of the cache key.
+        """
+
+        key = (url, parse_only)
+        with self._soup_lock:
+            soup = self._soups.get(key)
+        if soup is None:
+            soup = BeautifulSoup(self.get_text(url), "lxml", parse_only=parse_only)
+            with self._soup_lock:
+                soup = self._soups.setdefault(key, soup)
+        return soup
+
+    def warm_up(self) -> None:
+        """Open the first pooled connection before the worker pools start.
+
+        A HEAD request to the site root resolves the host and completes the
+        TLS handshake once; the connection then goes back to the pool, so the
+        catalog request and the first workers reuse it instead of each
+        connecting from scratch.
+        """
+
+        self.limiter.acquire()
+        try:
+            self.session.head(BASE_URL, timeout=self.timeout)
+        except requests.RequestException:
+            pass  # the real request will report the failure
 
     # ------------------------------------------------------------------
     def fetch_category_links(self, categories: Sequence[str]) -> Dict[str, str]:
         """Return a mapping from category name to absolute URL."""
 
-        page = self.get_text(CATALOG_URL)
-        soup = BeautifulSoup(page, "html.parser")
+        soup = self.get_soup(CATALOG_URL, ANCHOR_STRAINER)
         wanted = {name: None for name in categories}
         for anchor in soup.find_all("a", href=True):
             normalized = anchor.get_text(strip=True)
@@ -118,13 +418,10 @@ class CPCScraper:
     def fetch_products(self, category_url: str) -> Dict[str, str]:
         """Return mapping from product name to detail page."""
 
-        html = self.get_text(category_url)
-        soup = BeautifulSoup(html, "html.parser")
+        soup = self.get_soup(category_url, ANCHOR_STRAINER)
         products: Dict[str, str] = {}
-        for anchor in soup.find_all("a", href=True):
+        for anchor in soup.find_all("a", href=PRODUCT_LINK_PATTERN):
             href = anchor["href"]
-            if "C_Products_Detail" not in href:
-                continue
             name = anchor.get_text(strip=True) or anchor.get("title", "").strip()
             if not name:
                 continue
@@ -136,8 +433,7 @@ class CPCScraper:
         return products
 
     def fetch_product_images(self, product_url: str) -> List[str]:
-        html = self.get_text(product_url)
-        soup = BeautifulSoup(html, "html.parser")
+        soup = self.get_soup(product_url, IMAGE_STRAINER)
         candidates: List[str] = []
         for img in soup.find_all("img", src=True):
             src = img["src"]
@@ -154,44 +450,203 @@ def sanitize_name(value: str) -> str:
     return safe or "product"
 
 
-def save_images(scraper: CPCScraper, product: str, images: Sequence[str], folder: Path) -> DownloadResult:
+def save_images(
+    scraper: CPCScraper,
+    product: str,
+    images: Sequence[str],
+    folder: Path,
+    workers: int = DEFAULT_WORKERS,
+    cache: Optional[ValidatorCache] = None,
+    refresh: bool = False,
+    store: Optional[ImageStore] = None,
+    progress: Optional[Callable[[int], object]] = None,
+    executor: Optional[Executor] = None,
+) -> DownloadResult:
+    """Download ``images`` into a folder named after ``product``.
+
+    ``progress`` is called with the number of images finished (downloaded
+    or skipped) as they complete, from the calling thread.  Downloads run on
+    ``executor`` when given, so several products can share one image pool;
+    otherwise a private pool of ``workers`` threads is used.
+    """
+
     product_dir = folder / sanitize_name(product)
     product_dir.mkdir(parents=True, exist_ok=True)
     downloaded: List[Path] = []
     skipped = 0
+    pending: List[Tuple[int, str, Path]] = []
+    # One directory listing instead of a stat() per image.
+    existing = {entry.name for entry in os.scandir(product_dir)}
     for index, url in enumerate(images, start=1):
         ext = os.path.splitext(url.split("?")[0])[1] or ".jpg"
         filename = f"{index:02d}{ext}"
         destination = product_dir / filename
-        if destination.exists():
-            skipped += 1
-            continue
-        data = scraper.get_binary(url)
-        destination.write_bytes(data)
-        downloaded.append(destination)
+        if filename in existing:
+            # Existing copies are only revalidated on request; without
+            # validators there is nothing cheaper than skipping them.
+            if not (refresh and cache and cache.conditional_headers(url, destination)):
+                skipped += 1
+                continue
+        pending.append((index, url, destination))
+    if progress and skipped:
+        progress(skipped)
+
+    def download(url: str, destination: Path) -> bool:
+        stored = store.lookup(url) if store else None
+        if stored is not None:
+            store.link(stored, destination)
+            if cache:
+                cache.share(url, destination)
+            return True
+        digest = scraper.get_binary(url, destination, cache)
+        if digest is None:
+            return False
+        if store:
+            store.adopt(url, destination, digest)
+        return True
+
+    # Image downloads are bound by network latency, so fetch them concurrently.
+    # The shared requests.Session is safe for concurrent GETs and keeps the
+    # connection pool warm between images.
+    own_executor = executor is None
+    pool = ThreadPoolExecutor(max_workers=max(1, workers)) if own_executor else executor
+    try:
+        futures = {
+            pool.submit(download, url, destination): destination
+            for _, url, destination in pending
+        }
+        for future in as_completed(futures):
+            try:
+                ok = future.result()
+            except Exception as exc:
+                # Report the image and keep going; the rest of the product
+                # still finishes before the folder is handed to anyone else.
+                tqdm.write(f"⚠️ 圖片下載失敗: {futures[future]} ({exc})")
+                ok = False
+            if ok:
+                downloaded.append(futures[future])
+            else:
+                skipped += 1
+            if progress:
+                progress(1)
+    finally:
+        if own_executor:
+            pool.shutdown()
+    downloaded.sort()
     return DownloadResult(product=product, images=downloaded, skipped=skipped)
 
 
-def run(categories: Sequence[str], output: Path, delay: float, retries: int, timeout: int) -> None:
-    scraper = CPCScraper(delay=delay, retries=retries, timeout=timeout)
+def run(
+    categories: Sequence[str],
+    output: Path,
+    rate_limit: float,
+    retries: int,
+    timeout: int,
+    workers: int = DEFAULT_WORKERS,
+    refresh: bool = False,
+) -> None:
+    scraper = CPCScraper(
+        rate_limit=rate_limit, retries=retries, timeout=timeout, workers=workers
+    )
+    scraper.warm_up()
     category_links = scraper.fetch_category_links(categories)
     output.mkdir(parents=True, exist_ok=True)
+    cache = ValidatorCache(output / CACHE_FILENAME)
+    store = ImageStore(output / STORE_DIRNAME)
+    try:
+        _crawl(scraper, category_links, output, workers, cache, refresh, store)
+    finally:
+        cache.save()
+
+
+def _crawl(
+    scraper: CPCScraper,
+    category_links: Dict[str, str],
+    output: Path,
+    workers: int,
+    cache: ValidatorCache,
+    refresh: bool,
+    store: ImageStore,
+) -> None:
+    # Categories, product pages and images form a pipeline: as soon as a
+    # category lists its products their detail pages are queued, and each
+    # product starts downloading as soon as its page is parsed.  HTML latency
+    # therefore overlaps with image transfers instead of running as separate
+    # phases.  Product jobs block on their images, so images get a pool of
+    # their own to keep page workers from starving it.
+    lock = threading.Lock()
+    product_counts: Dict[str, int] = {}
+    totals: Dict[str, List[int]] = {category: [0, 0] for category in category_links}
+    folder_locks: Dict[Path, threading.Lock] = {}
+
+    pages = ThreadPoolExecutor(max_workers=max(1, workers))
+    images = ThreadPoolExecutor(max_workers=max(1, workers))
+    with pages, images, tqdm(total=0, desc="Downloading", unit="img") as pbar:
+
+        def progress(count: int) -> None:
+            with lock:
+                pbar.update(count)
 
-    for category, url in category_links.items():
-        print(f"處理分類: {category} -> {url}")
-        products = scraper.fetch_products(url)
-        for product, detail_url in products.items():
-            print(f"  下載產品: {product}")
+        def process(category: str, product: str, detail_url: str) -> Optional[DownloadResult]:
             image_urls = scraper.fetch_product_images(detail_url)
             if not image_urls:
-                print(f"    ⚠️ 找不到圖片: {detail_url}")
+                tqdm.write(f"⚠️ 找不到圖片: {product} ({detail_url})")
+                return None
+            folder = output / sanitize_name(category)
+            with lock:
+                pbar.total += len(image_urls)
+                pbar.refresh()
+                # Names that sanitize alike (e.g. all-Chinese ones become
+                # "product") share a folder; save those products one at a time
+                # so the later one sees the earlier files instead of racing them.
+                folder_lock = folder_locks.setdefault(
+                    folder / sanitize_name(product), threading.Lock()
+                )
+            with folder_lock:
+                return save_images(
+                    scraper,
+                    product,
+                    image_urls,
+                    folder,
+                    workers=workers,
+                    cache=cache,
+                    refresh=refresh,
+                    store=store,
+                    progress=progress,
+                    executor=images,
+                )
+
+        category_futures = {
+            pages.submit(scraper.fetch_products, url): category
+            for category, url in category_links.items()
+        }
+        product_futures = {}
+        for future in as_completed(category_futures):
+            category = category_futures[future]
+            products = future.result()
+            product_counts[category] = len(products)
+            for product, detail_url in products.items():
+                job = pages.submit(process, category, product, detail_url)
+                product_futures[job] = (category, product)
+
+        for future in as_completed(product_futures):
+            category, product = product_futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                # One broken product page or image should not end the run.
+                tqdm.write(f"⚠️ 下載失敗: {product} ({exc})")
                 continue
-            result = save_images(scraper, product, image_urls, output / sanitize_name(category))
-            print(
-                f"    完成 {len(result.images)} 張 (略過 {result.skipped}) -> {result.product}"
-            )
-            if scraper.delay:
-                time.sleep(scraper.delay)
+            if result is None:
+                continue
+            totals[category][0] += len(result.images)
+            totals[category][1] += result.skipped
+
+    for category, (downloaded, skipped) in totals.items():
+        print(
+            f"分類 {category}: {product_counts[category]} 項產品, "
+            f"完成 {downloaded} 張 (略過 {skipped}) -> {category_links[category]}"
+        )
 
 
 def parse_args(argv: Sequence[str]) -> argparse.Namespace:
@@ -209,10 +664,10 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
         help="圖片輸出資料夾",
     )
     parser.add_argument(
-        "--delay",
+        "--rate-limit",
         type=float,
-        default=0.5,
-        help="每次請求後的延遲秒數",
+        default=DEFAULT_RATE_LIMIT,
+        help="所有執行緒合計每秒最多的請求數 (0 表示不限制)",
     )
     parser.add_argument(
         "--retries",
@@ -226,13 +681,32 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
         default=15,
         help="請求逾時秒數",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="同時下載圖片的執行緒數量",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="以 ETag / Last-Modified 重新驗證已存在的圖片，有更新時才重新下載",
+    )
     return parser.parse_args(argv)
 
 
 def main(argv: Sequence[str]) -> int:
     args = parse_args(argv)
     try:
-        run(args.categories, args.output, args.delay, args.retries, args.timeout)
+        run(
+            args.categories,
+            args.output,
+            args.rate_limit,
+            args.retries,
+            args.timeout,
+            workers=args.workers,
+            refresh=args.refresh,
+        )
     except Exception as exc:  # pragma: no cover - CLI error handler
         print(f"發生錯誤: {exc}", file=sys.stderr)
         return 1
@@ -8,18 +8,25 @@ download_vehicle_images.py
   python download_vehicle_images.py --category "車輛用油" --follow-details --workers 6
 
 必要套件：
-  pip install requests beautifulsoup4 tqdm
+  pip install requests beautifulsoup4 lxml tqdm brotli
 """
 import os
+import re
+import json
 import time
+import shutil
 import hashlib
 import argparse
 import logging
+import threading
 from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Try to import tqdm for progress bar; fallback if missing
 try:
@@ -40,10 +47,21 @@ except Exception:
 # 設定
 USER_AGENT = "ImageDownloader/1.0 (+https://your.domain)"
 ALLOWED_IMAGE_EXT = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+# 單一預先編譯的副檔名判斷，取代逐一 endswith(ALLOWED_IMAGE_EXT)；
+# 只比對 ? 之前的路徑，查詢字串裡的 img=b.png 不算圖片
+_IMG_EXT_RE = re.compile(
+    r"^[^?]*\.(?:%s)(?:$|\?)" % "|".join(re.escape(ext[1:]) for ext in ALLOWED_IMAGE_EXT), re.IGNORECASE
+)
 DEFAULT_OUTDIR = "downloads/vehicle_oil"
 REQUEST_TIMEOUT = 20
 RETRY_TIMES = 3
-SLEEP_BETWEEN_REQUESTS = 0.8  # rate limiting
+RATE_LIMIT = 4.0  # requests per second, shared by all workers
+CACHE_FILENAME = "cache.json"  # url -> ETag / Last-Modified 紀錄
+STORE_DIRNAME = "store_by_hash"  # 依內容 SHA-1 保存的圖片本體
+
+# 只解析需要的標籤，略過頁面其餘 DOM
+IMAGE_LINK_STRAINER = SoupStrainer(["img", "a"])
+ANCHOR_STRAINER = SoupStrainer("a", href=True)
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
@@ -65,97 +83,352 @@ def sanitize_filename_from_url(url):
     return name
 
 
-def fetch_url(session, url):
-    for attempt in range(1, RETRY_TIMES + 1):
+class RateLimiter:
+    """執行緒安全的 token bucket：全域限制每秒最多 rate 個請求"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ValidatorCache:
+    """記錄已下載圖片的 ETag / Last-Modified，供下次以條件式請求重新驗證"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
         try:
-            resp = session.get(url, timeout=REQUEST_TIMEOUT)
-            resp.raise_for_status()
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def conditional_headers(self, url, path):
+        with self.lock:
+            entry = self.entries.get(url)
+        if not entry or entry.get("path") != path or not os.path.exists(path):
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, url, resp_headers, path):
+        etag = resp_headers.get("ETag")
+        last_modified = resp_headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        with self.lock:
+            self.entries[url] = {"etag": etag or "", "last_modified": last_modified or "", "path": path}
+
+    def save(self):
+        # 先寫入暫存檔再 rename，避免中斷時留下損毀的 cache
+        with self.lock:
+            data = json.dumps(self.entries, ensure_ascii=False, indent=2)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+class ContentStore:
+    """依內容 SHA-1 去重：相同內容的圖片只保存一份，輸出檔為指向它的硬連結"""
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def adopt(self, tmp, digest, ext):
+        """把剛寫完、尚未發佈的暫存檔 tmp 收進 store。
+
+        tmp 只屬於這次寫入，store 連結到的一定是剛雜湊過的那份內容；
+        store 已有相同內容時，tmp 改成指向 store 那份的硬連結。
+        """
+        stored = os.path.join(self.root, digest[:2], digest + ext)
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        with self.lock:
+            try:
+                if os.path.exists(stored):
+                    link = tmp + ".link"
+                    os.link(stored, link)
+                    os.replace(link, tmp)
+                else:
+                    os.link(tmp, stored)
+            except OSError as e:
+                # 檔案系統不支援硬連結時保留原檔，只是不去重
+                logging.debug("content store link failed for %s: %s", tmp, e)
+
+
+def build_session(workers):
+    """建立共用的 Session：連線池大小配合 workers，並交由 urllib3 處理重試與退避"""
+    sess = requests.Session()
+    sess.headers.update({"User-Agent": USER_AGENT})
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=max(workers, 32),
+        max_retries=Retry(
+            total=RETRY_TIMES,
+            connect=RETRY_TIMES,
+            read=RETRY_TIMES,
+            status=RETRY_TIMES,
+            backoff_factor=0.5,
+            status_forcelist={429, 500, 502, 503, 504},
+            respect_retry_after_header=True,  # 429/503 時依伺服器的 Retry-After 等待
+            allowed_methods={"GET", "HEAD"},
+        ),
+    )
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+
+def fetch_url(session, url, limiter=None, headers=None, stream=False):
+    if limiter is not None:
+        limiter.acquire()
+    try:
+        resp = session.get(url, timeout=REQUEST_TIMEOUT, headers=headers, stream=stream)
+        if resp.status_code == 304:
             return resp
-        except Exception as e:
-            logging.debug("fetch error (%s) attempt %d/%d: %s", url, attempt, RETRY_TIMES, e)
-            time.sleep(1 * attempt)
+        resp.raise_for_status()
+        return resp
+    except Exception as e:
+        logging.debug("fetch error (%s): %s", url, e)
     logging.warning("Failed to fetch URL after retries: %s", url)
     return None
 
 
 def parse_image_urls(base_url, html):
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml", parse_only=IMAGE_LINK_STRAINER)
     imgs = set()
-    # 1) <img> tags
-    for img in soup.find_all("img"):
-        src = img.get("src") or img.get("data-src")
-        if not src:
+    # single pass over <img> tags and <a> tags that directly link to image files
+    for tag in soup.find_all(["img", "a"]):
+        if tag.name == "img":
+            src = tag.get("src") or tag.get("data-src")
+            if not src:
+                continue
+            imgs.add(urljoin(base_url, src))
             continue
-        full = urljoin(base_url, src)
-        imgs.add(full)
-    # 2) <a> tags that directly link to image files
-    for a in soup.find_all("a"):
-        href = a.get("href")
+        href = tag.get("href")
         if not href:
             continue
         full = urljoin(base_url, href)
-        if any(full.lower().split("?")[0].endswith(ext) for ext in ALLOWED_IMAGE_EXT):
+        if _IMG_EXT_RE.match(full):
             imgs.add(full)
     return imgs
 
 
 def parse_detail_links(base_url, html):
     """解析商品細節頁連結（深度1用）— 會回傳與 base 同源的相對或絕對連結"""
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml", parse_only=ANCHOR_STRAINER)
     links = set()
-    for a in soup.find_all("a"):
-        href = a.get("href")
-        if not href:
-            continue
-        full = urljoin(base_url, href)
+    for a in soup.find_all("a", href=True):
+        full = urljoin(base_url, a["href"])
         # 過濾到同一個 domain（避免跑到外站）
         if is_same_origin(base_url, full):
             links.add(full)
     return links
 
 
-def download_image(session, url, outdir):
-    # skip non-image-looking urls early
-    if not any(url.lower().split("?")[0].endswith(ext) for ext in ALLOWED_IMAGE_EXT):
-        # still attempt to download if server serves correct content-type
+class HashingWriter:
+    """寫入檔案的同時更新 digest，讓 shutil.copyfileobj 一次完成寫檔與雜湊"""
+
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+
+    def write(self, chunk):
+        self.digest.update(chunk)
+        return self.f.write(chunk)
+
+
+def write_atomic(path, src, digest, store=None, length=None):
+    """把 src 串流寫入 path，中途失敗不會留下半個檔案。
+
+    Linux 上先寫入 O_TMPFILE 匿名檔，完成後才經由 /proc/self/fd 連結成暫存檔；
+    其他平台（或連結失敗時）改用同目錄的暫存檔。暫存檔名每次都不同，
+    同時寫入的 worker 不會互相覆蓋。有 store 時在發佈前先把這個暫存檔
+    收進 store，最後以 os.replace 放到 path。length 為 Content-Length 時，
+    寫入位元組數不符（urllib3 1.26 遇到連線中斷不會拋錯）就視為失敗。
+    """
+    outdir = os.path.dirname(path) or "."
+    tmp = _write_temp(outdir, os.path.basename(path), src, digest, length)
+    try:
+        if store is not None:
+            store.adopt(tmp, digest.hexdigest(), os.path.splitext(path)[1])
+        os.replace(tmp, path)
+    except BaseException:
+        _remove_quietly(tmp)
+        raise
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
         pass
+
+
+def _partial_name(name):
+    return f"{name}.{os.urandom(4).hex()}.part"
+
+
+def _check_length(written, length):
+    if length is not None and written != length:
+        raise IOError(f"incomplete body: {written} of {length} bytes")
+
+
+def _write_temp(outdir, name, src, digest, length=None):
+    """寫入 outdir 下的暫存檔並回傳其路徑，內容完整後才出現在目錄中"""
+    fd = None
+    if hasattr(os, "O_TMPFILE"):
+        try:
+            # mode 0o666 交給 umask 決定最終權限，與一般 open() 相同
+            fd = os.open(outdir, os.O_TMPFILE | os.O_RDWR, 0o666)
+        except OSError:
+            fd = None  # 檔案系統不支援 O_TMPFILE
+    if fd is None:
+        return _write_via_tempfile(outdir, name, src, digest, length)
+    with os.fdopen(fd, "w+b") as f:
+        shutil.copyfileobj(src, HashingWriter(f, digest), 1 << 16)
+        _check_length(f.tell(), length)
+        f.flush()
+        # 指定 dst_dir_fd 讓 os.link 走 linkat(AT_SYMLINK_FOLLOW)
+        dir_fd = os.open(outdir, os.O_RDONLY)
+        try:
+            while True:
+                tmp = _partial_name(name)
+                try:
+                    os.link(f"/proc/self/fd/{fd}", tmp, dst_dir_fd=dir_fd)
+                    return os.path.join(outdir, tmp)
+                except FileExistsError:
+                    continue
+        except OSError:
+            # 例如 /proc 未掛載：從匿名檔讀回，改走一般暫存檔
+            f.seek(0)
+            return _write_via_tempfile(outdir, name, f, None)
+        finally:
+            os.close(dir_fd)
+
+
+def _write_via_tempfile(outdir, name, src, digest, length=None):
+    # O_EXCL 確保暫存檔是新建的；0o666 同樣交給 umask（mkstemp 會是 0600）
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        tmp = os.path.join(outdir, _partial_name(name))
+        try:
+            fd = os.open(tmp, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(src, HashingWriter(f, digest) if digest else f, 1 << 16)
+            _check_length(f.tell(), length)
+    except BaseException:
+        _remove_quietly(tmp)
+        raise
+    return tmp
+
+
+# 不同網址可能對應到同一個輸出檔名，同一檔名一次只讓一個 worker 寫入
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _lock_for(path):
+    with _path_locks_guard:
+        return _path_locks.setdefault(path, threading.Lock())
+
+
+def download_image(session, url, outdir, limiter=None, cache=None, refresh=False, store=None):
+    # non-image-looking urls are still attempted if the server serves an image content-type
+    looks_like_image = bool(_IMG_EXT_RE.match(url))
     fname = sanitize_filename_from_url(url)
     path = os.path.join(outdir, fname)
-    # avoid re-downloading existing file (quick check)
+    with _lock_for(path):
+        return _download_to(session, url, path, looks_like_image, limiter, cache, refresh, store)
+
+
+def _download_to(session, url, path, looks_like_image, limiter, cache, refresh, store):
+    # avoid re-downloading existing file (quick check); with --refresh, revalidate
+    # it using the recorded ETag / Last-Modified instead
+    headers = None
     if os.path.exists(path):
-        return (url, path, "exists")
+        headers = cache.conditional_headers(url, path) if (refresh and cache) else None
+        if not headers:
+            return (url, path, "exists")
     try:
-        resp = fetch_url(session, url)
+        resp = fetch_url(session, url, limiter, headers, stream=True)
         if resp is None:
             return (url, None, "failed")
-        # Basic content-type check
-        ctype = resp.headers.get("Content-Type", "")
-        if not ctype.startswith("image/") and not any(url.lower().endswith(ext) for ext in ALLOWED_IMAGE_EXT):
-            logging.debug("skipping non-image content-type %s for %s", ctype, url)
-            return (url, None, "not-image")
-        # write file
-        with open(path, "wb") as f:
-            for chunk in resp.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        with resp:
+            if resp.status_code == 304:
+                return (url, path, "exists")
+            # Basic content-type check
+            ctype = resp.headers.get("Content-Type", "")
+            if not ctype.startswith("image/") and not looks_like_image:
+                logging.debug("skipping non-image content-type %s for %s", ctype, url)
+                return (url, None, "not-image")
+            # stream the body straight to disk, hashing it on the way for content dedupe
+            resp.raw.decode_content = True
+            length = resp.headers.get("Content-Length")
+            if resp.headers.get("Content-Encoding", "identity") != "identity":
+                length = None  # 解壓後的大小與 Content-Length 不同
+            write_atomic(path, resp.raw, hashlib.sha1(), store, int(length) if length else None)
+        if cache is not None:
+            cache.record(url, resp.headers, path)
         return (url, path, "ok")
     except Exception as e:
         logging.debug("download error %s: %s", url, e)
         return (url, None, "error")
 
 
-def check_robots_allowed(base_url, user_agent, target_path="/"):
-    # basic robots.txt check
+# scheme://netloc -> 已解析的 robots.txt，同一主機只下載一次
+_robots_cache = {}
+
+
+def get_robots(session, base_url, user_agent):
+    parsed = urlparse(base_url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    if origin in _robots_cache:
+        return _robots_cache[origin]
+    rp = RobotFileParser()
     try:
-        parsed = urlparse(base_url)
-        robots_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
-        r = requests.get(robots_url, timeout=REQUEST_TIMEOUT, headers={"User-Agent": user_agent})
-        if r.status_code != 200:
-            return True  # no robots, allow
-        from urllib.robotparser import RobotFileParser
-        rp = RobotFileParser()
+        r = session.get(origin + "/robots.txt", timeout=REQUEST_TIMEOUT, headers={"User-Agent": user_agent})
+    except Exception:
+        rp.allow_all = True  # network error: allow, but don't cache
+        return rp
+    if r.status_code != 200:
+        rp.allow_all = True  # no robots, allow
+    else:
         rp.parse(r.text.splitlines())
-        return rp.can_fetch(user_agent, target_path)
+    _robots_cache[origin] = rp
+    return rp
+
+
+def check_robots_allowed(session, base_url, user_agent, target_path="/"):
+    # basic robots.txt check
+    try:
+        return get_robots(session, base_url, user_agent).can_fetch(user_agent, target_path)
     except Exception:
         return True
 
@@ -166,7 +439,9 @@ def main():
     parser.add_argument("--outdir", default=DEFAULT_OUTDIR, help="Output directory")
     parser.add_argument("--follow-details", action="store_true", help="Also follow product detail links (depth=1) to find images")
     parser.add_argument("--workers", type=int, default=4, help="Number of concurrent downloads")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT, help="Max requests per second across all workers (0 = unlimited)")
     parser.add_argument("--max-detail-pages", type=int, default=30, help="Max number of detail pages to fetch when following details")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate existing images with ETag / Last-Modified and re-download only if changed")
     parser.add_argument("--verbose", action="store_true")
     args = parser.parse_args()
 
@@ -181,25 +456,44 @@ def main():
     start_url = info["cpc_url"]
     logging.info("開始：分類 %s -> %s", args.category, start_url)
 
-    # robots.txt check
-    allowed = check_robots_allowed(start_url, USER_AGENT, urlparse(start_url).path)
+    sess = build_session(args.workers)
+
+    # robots.txt check（經由共用 Session，也順便在 worker 啟動前完成 DNS 與 TLS 連線暖機）
+    allowed = check_robots_allowed(sess, start_url, USER_AGENT, urlparse(start_url).path)
     if not allowed:
         logging.error("robots.txt 不允許抓取該路徑，停止。")
         return
 
+    # honor Crawl-delay if robots.txt asks for a slower pace than --rate-limit
+    rate = args.rate_limit
+    crawl_delay = get_robots(sess, start_url, USER_AGENT).crawl_delay(USER_AGENT)
+    if crawl_delay:
+        rate = min(rate, 1 / float(crawl_delay)) if rate > 0 else 1 / float(crawl_delay)
+        logging.info("robots.txt Crawl-delay %s 秒，請求速率限制為每秒 %.2f 次", crawl_delay, rate)
+    limiter = RateLimiter(rate)
+
     os.makedirs(args.outdir, exist_ok=True)
-    sess = requests.Session()
-    sess.headers.update({"User-Agent": USER_AGENT})
 
     # fetch category page
-    resp = fetch_url(sess, start_url)
+    resp = fetch_url(sess, start_url, limiter)
     if resp is None:
         logging.error("無法取得分類頁面：%s", start_url)
         return
     html = resp.text
 
+    # only same-origin candidates are kept for download; seen_pages holds at
+    # most --max-detail-pages + 1 urls
+    parsed_start = urlparse(start_url)
+    seen_pages = set()
+    seen_pages.add(start_url)
     image_urls = set()
-    image_urls.update(parse_image_urls(start_url, html))
+
+    def collect(page_url, page_html):
+        for u in parse_image_urls(page_url, page_html):
+            if urlparse(u).netloc == parsed_start.netloc:
+                image_urls.add(u)
+
+    collect(start_url, html)
 
     detail_links = set()
     if args.follow_details:
@@ -208,29 +502,36 @@ def main():
         logging.info("分類頁面找到 %d 內部連結，會嘗試追訪以搜尋圖片（上限 %d）", len(detail_links), args.max_detail_pages)
         # limit number of pages to avoid過多請求
         detail_links = list(detail_links)[: args.max_detail_pages]
-        # Fetch each detail page and parse images
-        for link in tqdm(detail_links, desc="Fetching detail pages"):
-            time.sleep(SLEEP_BETWEEN_REQUESTS)
-            r = fetch_url(sess, link)
-            if not r:
-                continue
-            image_urls.update(parse_image_urls(link, r.text))
-
-    # Filter image URLs to same origin or allow remote?
-    # We'll allow same-origin and absolute image links under same domain
-    parsed_start = urlparse(start_url)
-    image_urls = {u for u in image_urls if urlparse(u).netloc == parsed_start.netloc}
+        # Fetch detail pages concurrently; the shared limiter caps the overall request rate
+        with ThreadPoolExecutor(max_workers=args.workers) as ex:
+            pages = ex.map(lambda link: fetch_url(sess, link, limiter), detail_links)
+            for r in tqdm(pages, total=len(detail_links), desc="Fetching detail pages"):
+                if not r:
+                    continue
+                # several links may redirect to the same page; parse it once
+                if r.url in seen_pages:
+                    continue
+                seen_pages.add(r.url)
+                collect(r.url, r.text)
 
     logging.info("總共發現 %d 圖片候選檔案（同源過濾後）", len(image_urls))
 
     # download images concurrently
     results = []
-    with ThreadPoolExecutor(max_workers=args.workers) as ex:
-        futures = {ex.submit(download_image, sess, url, args.outdir): url for url in image_urls}
-        for f in tqdm(as_completed(futures), total=len(futures), desc="Downloading"):
-            # as_completed yields futures as they finish
-            res = f.result()
-            results.append(res)
+    cache = ValidatorCache(os.path.join(args.outdir, CACHE_FILENAME))
+    store = ContentStore(os.path.join(args.outdir, STORE_DIRNAME))
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as ex:
+            futures = {
+                ex.submit(download_image, sess, url, args.outdir, limiter, cache, args.refresh, store): url
+                for url in image_urls
+            }
+            for f in tqdm(as_completed(futures), total=len(futures), desc="Downloading"):
+                # as_completed yields futures as they finish
+                res = f.result()
+                results.append(res)
+    finally:
+        cache.save()
 
     # summarize
     ok = [r for r in results if r[2] == "ok"]
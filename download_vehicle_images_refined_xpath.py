@@ -4,7 +4,7 @@
 Refined downloader with XPath support.
 
 Usage examples:
-  pip install cloudscraper beautifulsoup4 lxml tqdm
+  pip install cloudscraper beautifulsoup4 lxml tqdm  (orjson optional, speeds up candidates.json)
   python download_vehicle_images_refined_xpath.py --category "車輛用油" --img-xpath '//*[@id="ContentPlaceHolder1_divMarqueePics"]/div/div/div/div/ul/li/div/div/div/div/span' --list-only
   python download_vehicle_images_refined_xpath.py --category "車輛用油" --img-xpath '...same...' --download
 
@@ -16,13 +16,16 @@ Notes:
 import os
 import re
 import json
-import time
 import hashlib
+import shutil
 import argparse
-from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from urllib.parse import urljoin as _urljoin, urlparse
 
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from urllib3.util.retry import Retry
 
 try:
     import cloudscraper
@@ -30,52 +33,95 @@ except Exception:
     cloudscraper = None
 
 try:
-    import lxml.html
+    import orjson
 except Exception:
-    lxml = None
-    lxml_html = None
-else:
-    lxml_html = lxml.html
+    orjson = None
+
+from lxml import etree as lxml_etree
+from lxml import html as lxml_html
 
 ALLOWED_EXT = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
 DEFAULT_OUTDIR = "downloads/vehicle_oil_xpath"
 REQUEST_TIMEOUT = 30
-SLEEP = 0.6
+WORKERS = 16
+POOL_SIZE = 64
+
+# XPath expressions compiled once and reused for every page / node
+_IMG_XP = lxml_etree.XPath('.//img')
+_A_HREF = lxml_etree.XPath('//a[@href]')
+
+# <img> tags plus every anchor in one pass, in document order; anchors are
+# kept only when their href passes _EXT_RE
+_COLLECT = lxml_etree.XPath('//img[@src or @data-src] | //a[@href]')
+# image extension on the part before the query string, in one match
+_EXT_RE = re.compile(r'^[^?]*\.(?:jpe?g|png|gif|webp|bmp)(?:$|\?)', re.IGNORECASE)
+
+_STYLE_URL = re.compile(r'url\((["\']?)(.*?)\1\)', re.IGNORECASE)
+_STYLE_URL2 = re.compile(r'url[:=]\s*(["\']?)(.*?)\1', re.IGNORECASE)
 
+# base_url is constant per page and nav/thumbnail srcs repeat across pages
+urljoin = lru_cache(maxsize=4096)(_urljoin)
+
+@lru_cache(maxsize=32)
+def _compile_xpath(expr):
+    return lxml_etree.XPath(expr)
+
+@lru_cache(maxsize=8192)
 def sanitize_name(url):
-    p = urlparse(url)
-    name = os.path.basename(p.path) or "image"
-    name = name.split("?")[0]
-    if not os.path.splitext(name)[1]:
+    # plain string split instead of urlparse; sha1 suffix only when the name
+    # has no image extension (also keeps e.g. GetImage.ashx?id=1 / id=2 apart)
+    name = url.split("#", 1)[0].split("?", 1)[0].rsplit("/", 1)[-1] or "image"
+    if os.path.splitext(name)[1].lower() not in ALLOWED_EXT:
         name = name + "_" + hashlib.sha1(url.encode()).hexdigest()[:8]
     return name
 
 def extract_url_from_style(style_value):
     # extract url(...) from style background-image
-    m = re.search(r'url\((["\']?)(.*?)\1\)', style_value, flags=re.IGNORECASE)
+    m = _STYLE_URL.search(style_value)
     if m:
         return m.group(2)
     # fallback: look for plain url without parentheses
-    m2 = re.search(r'url[:=]\s*(["\']?)(.*?)\1', style_value, flags=re.IGNORECASE)
+    m2 = _STYLE_URL2.search(style_value)
     if m2:
         return m2.group(2)
     return None
 
-def images_from_xpath_html(base_url, html, xpath_expr):
+def _as_doc(html):
+    # accept raw html or an already-parsed lxml tree so callers can parse once
+    if isinstance(html, (str, bytes)):
+        return lxml_html.fromstring(html)
+    return html
+
+def _node_repr(node, full):
+    # serializing the whole subtree only pays off when someone reads it
+    if full:
+        return lxml_html.tostring(node, encoding='unicode', with_tail=False)[:200]
+    return f"<{node.tag} class={node.get('class', '')!r}>"
+
+def images_from_xpath_html(base_url, html, xpath_expr, include_node_repr=False):
     """
     Use lxml to evaluate xpath_expr against html and return list of image dicts:
     {"url": full_url, "alt": alt_text, "node": repr}
+    html may be a string or a tree already parsed with lxml.html.
+    "node" is only the tag and class unless include_node_repr is set.
     """
-    if lxml_html is None:
-        raise RuntimeError("lxml is required for XPath mode. Install with: pip install lxml")
-    doc = lxml_html.fromstring(html)
+    doc = _as_doc(html)
     # ensure returned nodes for the xpath
-    nodes = doc.xpath(xpath_expr)
+    nodes = _compile_xpath(xpath_expr)(doc)
     results = []
+    seen = set()
+
+    def add(full, alt, node):
+        # dedupe inline so repeated urls never get a result entry
+        if full in seen:
+            return
+        seen.add(full)
+        results.append({"url": full, "alt": alt, "node": _node_repr(node, include_node_repr)})
+
     for node in nodes:
         # node may be an element, get inner <img> if present
         try:
-            imgs = node.xpath('.//img')
+            imgs = _IMG_XP(node)
         except Exception:
             imgs = []
         if imgs:
@@ -84,7 +130,7 @@ def images_from_xpath_html(base_url, html, xpath_expr):
                 alt = (im.get('alt') or '').strip()
                 if src:
                     full = urljoin(base_url, src)
-                    results.append({"url": full, "alt": alt, "node": lxml_html.tostring(node, encoding='unicode', with_tail=False)[:200]})
+                    add(full, alt, node)
                     continue
         # if no <img>, check node's style attribute for background-image
         style = node.get('style') if hasattr(node, 'get') else None
@@ -92,59 +138,53 @@ def images_from_xpath_html(base_url, html, xpath_expr):
             found = extract_url_from_style(style)
             if found:
                 full = urljoin(base_url, found)
-                results.append({"url": full, "alt": "", "node": lxml_html.tostring(node, encoding='unicode', with_tail=False)[:200]})
+                add(full, "", node)
                 continue
         # if still nothing, maybe the node itself has data-* attributes with image url
         for attr in ('data-src', 'data-original', 'data-image', 'data-bg'):
             val = node.get(attr) if hasattr(node, 'get') else None
             if val:
                 full = urljoin(base_url, val)
-                results.append({"url": full, "alt": "", "node": lxml_html.tostring(node, encoding='unicode', with_tail=False)[:200]})
+                add(full, "", node)
                 break
         # Lastly, try if the node contains a parent <a> linking to a detail page
         # That will be handled by caller if follow-details is enabled
-    # dedupe
-    seen = set()
-    uniq = []
-    for r in results:
-        if r["url"] not in seen:
-            seen.add(r["url"])
-            uniq.append(r)
-    return uniq
-
-def parse_images_from_html(base_url, html, img_selector=None):
-    soup = BeautifulSoup(html, "html.parser")
+    return results
+
+def parse_images_from_html(base_url, html, img_selector=None, include_node_repr=False):
     imgs = []
+    seen = set()
     if img_selector:
+        # CSS selectors stay on BeautifulSoup (lxml would need cssselect)
+        soup = BeautifulSoup(html, "lxml")
         nodes = soup.select(img_selector)
         for img in nodes:
             src = img.get("src") or img.get("data-src")
             if not src:
                 continue
             full = urljoin(base_url, src)
+            if full in seen:
+                continue
+            seen.add(full)
             imgs.append({"url": full, "alt": img.get("alt") or "", "node": str(img)[:200]})
     else:
-        for img in soup.find_all("img"):
-            src = img.get("src") or img.get("data-src")
-            if not src:
-                continue
+        for el in _COLLECT(_as_doc(html)):
+            if el.tag == "img":
+                src = el.get("src") or el.get("data-src")
+                if not src:
+                    continue
+                alt = el.get("alt") or ""
+            else:
+                src = el.get("href")
+                if not _EXT_RE.match(src):
+                    continue
+                alt = el.text_content().strip()
             full = urljoin(base_url, src)
-            imgs.append({"url": full, "alt": img.get("alt") or "", "node": str(img)[:200]})
-        for a in soup.find_all("a"):
-            href = a.get("href")
-            if not href:
+            if full in seen:
                 continue
-            full = urljoin(base_url, href)
-            if any(full.lower().split("?")[0].endswith(ext) for ext in ALLOWED_EXT):
-                imgs.append({"url": full, "alt": a.get_text(strip=True) or "", "node": str(a)[:200]})
-    # dedupe
-    seen = set()
-    uniq = []
-    for i in imgs:
-        if i["url"] not in seen:
-            seen.add(i["url"])
-            uniq.append(i)
-    return uniq
+            seen.add(full)
+            imgs.append({"url": full, "alt": alt, "node": _node_repr(el, include_node_repr)})
+    return imgs
 
 def fetch_with_scraper(scraper, url, timeout=REQUEST_TIMEOUT):
     try:
@@ -154,6 +194,140 @@ def fetch_with_scraper(scraper, url, timeout=REQUEST_TIMEOUT):
     except Exception:
         return None
 
+def parse_response(r):
+    """
+    Parse a response body with lxml.html, or return None if it cannot be parsed.
+    The raw bytes are parsed: a str body carrying an <?xml ... encoding=...?>
+    declaration makes lxml raise ValueError, and an empty body raises ParserError.
+    """
+    # a charset from the Content-Type header still wins over libxml2's own guess
+    declared = "charset" in r.headers.get("content-type", "").lower()
+    try:
+        parser = lxml_html.HTMLParser(encoding=r.encoding) if declared and r.encoding else None
+        return lxml_html.fromstring(r.content, parser=parser)
+    except Exception:
+        return None
+
+# size_pool / validators sidecar / download_one also live in
+# download_with_cloudscraper_Version2.py; keep the two copies in step
+def size_pool(scraper, size):
+    # resize cloudscraper's own adapters instead of mounting new ones: the https
+    # adapter carries the TLS cipher setup cloudscraper needs to pass Cloudflare
+    for prefix in ("https://", "http://"):
+        adapter = scraper.get_adapter(prefix)
+        adapter.max_retries = Retry(total=2, backoff_factor=0.2)
+        adapter.init_poolmanager(size, size)
+    # Accept-Encoding stays per request: identity for image bodies only, so
+    # the HTML pages still come back compressed
+    scraper.headers.update({"Connection": "keep-alive"})
+
+def _dumps(obj):
+    # orjson when installed; otherwise compact stdlib json, both as utf-8 bytes
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def write_manifest(path, start_url, candidates):
+    # stream one candidate at a time instead of building the whole document
+    with open(path, "wb") as jf:
+        jf.write(b'{"start_url":' + _dumps(start_url) + b',"candidates":[')
+        for i, c in enumerate(candidates):
+            if i:
+                jf.write(b",")
+            jf.write(_dumps(c))
+        jf.write(b"]}")
+
+ETAG_MANIFEST = "manifest.etag.json"
+
+def load_validators(outdir):
+    # sidecar of url -> {etag, last_modified, size} from earlier runs
+    try:
+        with open(os.path.join(outdir, ETAG_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_validators(outdir, validators):
+    path = os.path.join(outdir, ETAG_MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(validators, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def probe_image(scraper, u):
+    # HEAD probe so non-image urls never reach the download GET; when HEAD is
+    # refused (405/501) or fails, keep the url and let the GET decide
+    try:
+        rr = scraper.head(u, timeout=REQUEST_TIMEOUT, allow_redirects=True)
+    except Exception:
+        return True
+    if rr.status_code in (405, 501):
+        return True
+    return rr.status_code == 200 and rr.headers.get("content-type","").startswith("image")
+
+def _create_partial(outdir, fname):
+    # new, uniquely named temp file; mode 0o666 leaves the final permissions
+    # to the umask like a plain open() (mkstemp would give 0600)
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        tmp = os.path.join(outdir, f"{fname}.{os.urandom(4).hex()}.part")
+        try:
+            return os.open(tmp, flags, 0o666), tmp
+        except FileExistsError:
+            continue
+
+def download_one(scraper, u, outdir, existing, validators, refresh=False):
+    fname = sanitize_name(u)
+    dest = os.path.join(outdir, fname)
+    headers = {"Accept-Encoding": "identity"}
+    if fname in existing:
+        entry = validators.get(u) or {}
+        try:
+            size = os.path.getsize(dest)
+        except OSError:
+            size = -1
+        # an empty stub or a size other than the recorded one is fetched again
+        if size > 0 and size == entry.get("size", size):
+            # existing files are only revalidated with --refresh, and only
+            # when validators were recorded for them
+            if not (refresh and (entry.get("etag") or entry.get("last_modified"))):
+                return
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+    # stream into a private temp file and move it into place only after the
+    # whole body arrived, so a failed transfer never leaves a stub at dest
+    fd, tmp = _create_partial(outdir, fname)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # images are already compressed, so ask for the raw bytes and let
+            # copyfileobj move them to disk in large C-level chunks
+            with scraper.get(u, timeout=REQUEST_TIMEOUT, stream=True, headers=headers) as rr:
+                if rr.status_code == 304:
+                    return
+                if rr.status_code != 200 or not rr.headers.get("content-type","").startswith("image"):
+                    print("Skipping non-image or bad status for", u, rr.status_code, rr.headers.get("content-type"))
+                    return
+                rr.raw.decode_content = True
+                shutil.copyfileobj(rr.raw, f, length=1024 * 1024)
+                written = f.tell()
+        # urllib3 2 raises on a short body; older urllib3 ends the stream quietly
+        expected = rr.headers.get("content-length")
+        if expected and rr.headers.get("content-encoding", "identity") == "identity" and int(expected) != written:
+            print("Incomplete download for", u, written, "of", expected)
+            return
+        os.replace(tmp, dest)
+        existing.add(fname)
+        validators[u] = {"etag": rr.headers.get("etag"), "last_modified": rr.headers.get("last-modified"), "size": written}
+    except Exception as e:
+        print("Download error for", u, e)
+    finally:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--category", default="車輛用油")
@@ -164,14 +338,13 @@ def main():
     parser.add_argument("--insecure", action="store_true", help="Disable SSL verification (test only)")
     parser.add_argument("--outdir", default=DEFAULT_OUTDIR)
     parser.add_argument("--list-only", action="store_true", help="Only list candidates, don't download")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent page fetches / downloads")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate existing images with ETag / Last-Modified and re-download only if changed")
     args = parser.parse_args()
 
     if cloudscraper is None:
         print("Please install cloudscraper: pip install cloudscraper")
         return
-    if args.img_xpath and lxml_html is None:
-        print("XPath mode requires lxml: pip install lxml")
-        return
 
     # get category url from product_classification if available
     try:
@@ -185,6 +358,8 @@ def main():
     print("Start URL:", start_url)
 
     scraper = cloudscraper.create_scraper(browser={"custom": "Mozilla/5.0"})
+    # one pooled connection per worker so concurrent requests reuse TCP/TLS
+    size_pool(scraper, max(args.workers, POOL_SIZE))
     if args.insecure:
         scraper.verify = False
         import urllib3
@@ -200,12 +375,16 @@ def main():
         print("Failed to fetch category page.")
         return
     cat_html = r.text
+    # parse the category page once; XPath, generic and anchor passes share the tree
+    cat_doc = parse_response(r)
+    if cat_doc is None:
+        print("Category page could not be parsed as HTML.")
 
     candidates = []
     # XPath mode
-    if args.img_xpath:
+    if args.img_xpath and cat_doc is not None:
         try:
-            matches = images_from_xpath_html(start_url, cat_html, args.img_xpath)
+            matches = images_from_xpath_html(start_url, cat_doc, args.img_xpath, include_node_repr=args.list_only)
             for m in matches:
                 candidates.append({"source": start_url, "image": m})
         except Exception as e:
@@ -216,55 +395,62 @@ def main():
         for m in matches:
             candidates.append({"source": start_url, "image": m})
     # fallback to generic parsing if still empty
-    if not candidates:
-        matches = parse_images_from_html(start_url, cat_html)
+    if not candidates and cat_doc is not None:
+        matches = parse_images_from_html(start_url, cat_doc, include_node_repr=args.list_only)
         for m in matches:
             candidates.append({"source": start_url, "image": m})
 
+    # same-host check as a plain prefix test instead of urlparse per url
+    parsed_start = urlparse(start_url)
+    same_host = (f"https://{parsed_start.netloc}/", f"http://{parsed_start.netloc}/")
+
     # If follow-details is requested and XPath points to a container with links, we may want to find detail links:
     detail_links = []
-    if args.follow_details:
+    if args.follow_details and cat_doc is not None:
         # simple same-origin anchor collection
-        soup = BeautifulSoup(cat_html, "html.parser")
-        for a in soup.find_all("a", href=True):
-            full = urljoin(start_url, a['href'])
-            if urlparse(full).netloc == urlparse(start_url).netloc:
+        for a in _A_HREF(cat_doc):
+            full = urljoin(start_url, a.get('href'))
+            if full.startswith(same_host):
                 detail_links.append(full)
         # optionally trim
         detail_links = list(dict.fromkeys(detail_links))[:60]
-        # fetch each and run xpath/selector on detail pages
-        for link in tqdm(detail_links, desc="Detail pages"):
-            time.sleep(SLEEP)
-            rr = fetch_with_scraper(scraper, link)
-            if not rr:
+
+        # fetch detail pages concurrently and run xpath/selector on each
+        with ThreadPoolExecutor(max_workers=args.workers) as ex:
+            pages = list(tqdm(ex.map(partial(fetch_with_scraper, scraper), detail_links), total=len(detail_links), desc="Detail pages"))
+        for link, rr in zip(detail_links, pages):
+            if rr is None:
                 continue
-            html = rr.text
-            if args.img_xpath:
-                try:
-                    matches = images_from_xpath_html(link, html, args.img_xpath)
-                except Exception:
-                    matches = []
+            if args.img_selector and not args.img_xpath:
+                # BeautifulSoup parses the text itself; no lxml tree needed
+                matches = parse_images_from_html(link, rr.text, img_selector=args.img_selector)
             else:
-                matches = parse_images_from_html(link, html, img_selector=args.img_selector)
+                doc = parse_response(rr)
+                if doc is None:
+                    continue
+                if args.img_xpath:
+                    try:
+                        matches = images_from_xpath_html(link, doc, args.img_xpath, include_node_repr=args.list_only)
+                    except Exception:
+                        matches = []
+                else:
+                    matches = parse_images_from_html(link, doc, include_node_repr=args.list_only)
             for m in matches:
                 candidates.append({"source": link, "image": m})
 
-    # filter same-origin and dedupe
-    parsed_start = urlparse(start_url)
+    # filter same-origin and dedupe across pages (each page's list is already unique)
     final = []
     seen = set()
     for c in candidates:
         u = c["image"]["url"]
-        if urlparse(u).netloc != parsed_start.netloc:
+        if not u.startswith(same_host):
             continue
         if u in seen:
             continue
         seen.add(u)
         final.append(c)
 
-    manifest = {"start_url": start_url, "candidates": final}
-    with open(os.path.join(args.outdir, "candidates.json"), "w", encoding="utf-8") as jf:
-        json.dump(manifest, jf, ensure_ascii=False, indent=2)
+    write_manifest(os.path.join(args.outdir, "candidates.json"), start_url, final)
     print("Saved candidates manifest:", os.path.join(args.outdir, "candidates.json"))
     print(f"Found {len(final)} image candidates.")
 
@@ -276,24 +462,17 @@ def main():
 
     if args.download and final and not args.list_only:
         print("Downloading images...")
-        for it in tqdm(final, desc="Downloading"):
-            u = it["image"]["url"]
-            fname = sanitize_name(u)
-            dest = os.path.join(args.outdir, fname)
-            if os.path.exists(dest):
-                continue
-            try:
-                rr = scraper.get(u, timeout=REQUEST_TIMEOUT, stream=True)
-                if rr.status_code == 200 and rr.headers.get("content-type","").startswith("image"):
-                    with open(dest, "wb") as f:
-                        for chunk in rr.iter_content(8192):
-                            if chunk:
-                                f.write(chunk)
-                    time.sleep(SLEEP)
-                else:
-                    continue
-            except Exception as e:
-                print("Download error for", u, e)
+        # one directory listing instead of a stat() per candidate
+        existing = set(os.listdir(args.outdir))
+        validators = load_validators(args.outdir)
+        with ThreadPoolExecutor(max_workers=args.workers) as ex:
+            # only urls not on disk yet are probed; saved files go straight to
+            # the conditional GET
+            fresh = [c["image"]["url"] for c in final if sanitize_name(c["image"]["url"]) not in existing]
+            is_image = dict(zip(fresh, ex.map(partial(probe_image, scraper), fresh)))
+            urls = [c["image"]["url"] for c in final if is_image.get(c["image"]["url"], True)]
+            list(tqdm(ex.map(partial(download_one, scraper, outdir=args.outdir, existing=existing, validators=validators, refresh=args.refresh), urls), total=len(urls), desc="Downloading"))
+        save_validators(args.outdir, validators)
         print("Downloaded images to:", os.path.abspath(args.outdir))
 
 if __name__ == "__main__":
@@ -1,24 +1,36 @@
 # 使用 cloudscraper 嘗試取得分類頁並下載圖片
 # 新增 --insecure 選項，若目標站 TLS 有問題可暫時使用（不建議在生產）
+# 併發：圖片以 --workers 個執行緒同時下載，全部共用同一個 cloudscraper session，
+# Cloudflare 驗證只需通過一次、cookie 與連線池由所有 worker 共享；
+# 不改用 asyncio/httpx，因為那會繞過 cloudscraper 的 TLS 設定而失去 Cloudflare 相容性
 
 import os
-import time
+import re
+import json
 import hashlib
+import shutil
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 import cloudscraper
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 
 DEFAULT_OUTDIR = "downloads/vehicle_oil"
 ALLOWED_EXT = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
-SLEEP = 0.8
+# image-extension test on the part before the query string, in one match
+_EXT_RE = re.compile(r'^[^?]*\.(?:jpe?g|png|gif|webp|bmp)(?:$|\?)', re.IGNORECASE)
+WORKERS = 16
+POOL_SIZE = 64
 
+@lru_cache(maxsize=8192)
 def sanitize(url):
-    p = urlparse(url)
-    name = os.path.basename(p.path) or "image"
-    name = name.split("?")[0]
-    if not os.path.splitext(name)[1]:
+    # plain string split instead of urlparse; sha1 suffix only when the name
+    # has no image extension (also keeps e.g. GetImage.ashx?id=1 / id=2 apart)
+    name = url.split("#", 1)[0].split("?", 1)[0].rsplit("/", 1)[-1] or "image"
+    if os.path.splitext(name)[1].lower() not in ALLOWED_EXT:
         name = name + "_" + hashlib.sha1(url.encode()).hexdigest()[:8]
     return name
 
@@ -33,13 +45,118 @@ def parse_images(base_url, html):
         href = a.get("href")
         if not href: continue
         full = urljoin(base_url, href)
-        if any(full.lower().split("?")[0].endswith(ext) for ext in ALLOWED_EXT):
+        if _EXT_RE.match(full):
             imgs.add(full)
     return imgs
 
+# 以下下載流程與 download_vehicle_images_refined_xpath.py 相同，修改時兩邊一起更新
+def size_pool(scraper, size):
+    # resize cloudscraper's own adapters instead of mounting new ones: the https
+    # adapter carries the TLS cipher setup cloudscraper needs to pass Cloudflare
+    for prefix in ("https://", "http://"):
+        adapter = scraper.get_adapter(prefix)
+        adapter.max_retries = Retry(total=2, backoff_factor=0.2)
+        adapter.init_poolmanager(size, size)
+    # Accept-Encoding stays per request: identity for image bodies only, so
+    # the HTML pages still come back compressed
+    scraper.headers.update({"Connection": "keep-alive"})
+
+ETAG_MANIFEST = "manifest.etag.json"
+
+def load_validators(outdir):
+    # sidecar of url -> {etag, last_modified, size} from earlier runs
+    try:
+        with open(os.path.join(outdir, ETAG_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_validators(outdir, validators):
+    path = os.path.join(outdir, ETAG_MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(validators, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def probe_image(scraper, u):
+    # HEAD probe so non-image urls never reach the download GET; when HEAD is
+    # refused (405/501) or fails, keep the url and let the GET decide
+    try:
+        rr = scraper.head(u, timeout=30, allow_redirects=True)
+    except Exception:
+        return True
+    if rr.status_code in (405, 501):
+        return True
+    return rr.status_code == 200 and rr.headers.get("content-type","").startswith("image")
+
+def _create_partial(outdir, fname):
+    # new, uniquely named temp file; mode 0o666 leaves the final permissions
+    # to the umask like a plain open() (mkstemp would give 0600)
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        tmp = os.path.join(outdir, f"{fname}.{os.urandom(4).hex()}.part")
+        try:
+            return os.open(tmp, flags, 0o666), tmp
+        except FileExistsError:
+            continue
+
+def download_one(scraper, u, outdir, existing, validators, refresh=False):
+    fname = sanitize(u)
+    dest = os.path.join(outdir, fname)
+    headers = {"Accept-Encoding": "identity"}
+    if fname in existing:
+        entry = validators.get(u) or {}
+        try:
+            size = os.path.getsize(dest)
+        except OSError:
+            size = -1
+        # an empty stub or a size other than the recorded one is fetched again
+        if size > 0 and size == entry.get("size", size):
+            # existing files are only revalidated with --refresh, and only
+            # when validators were recorded for them
+            if not (refresh and (entry.get("etag") or entry.get("last_modified"))):
+                return
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+    # stream into a private temp file and move it into place only after the
+    # whole body arrived, so a failed transfer never leaves a stub at dest
+    fd, tmp = _create_partial(outdir, fname)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # images are already compressed, so ask for the raw bytes and let
+            # copyfileobj move them to disk in large C-level chunks
+            with scraper.get(u, timeout=30, stream=True, headers=headers) as rr:
+                if rr.status_code == 304:
+                    return
+                if rr.status_code != 200 or not rr.headers.get("content-type","").startswith("image"):
+                    print("Skipping non-image or bad status for", u, rr.status_code, rr.headers.get("content-type"))
+                    return
+                rr.raw.decode_content = True
+                shutil.copyfileobj(rr.raw, f, length=1024 * 1024)
+                written = f.tell()
+        # urllib3 2 raises on a short body; older urllib3 ends the stream quietly
+        expected = rr.headers.get("content-length")
+        if expected and rr.headers.get("content-encoding", "identity") == "identity" and int(expected) != written:
+            print("Incomplete download for", u, written, "of", expected)
+            return
+        os.replace(tmp, dest)
+        existing.add(fname)
+        validators[u] = {"etag": rr.headers.get("etag"), "last_modified": rr.headers.get("last-modified"), "size": written}
+    except Exception as e:
+        print("Download error for", u, e)
+    finally:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--insecure", action="store_true", help="Disable SSL verification (insecure)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent downloads")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate existing images with ETag / Last-Modified and re-download only if changed")
     args = parser.parse_args()
 
     start_url = "https://cpclube.cpc.com.tw/C_Products.aspx?n=7464&sms=12326&_CSN=13"
@@ -49,6 +166,8 @@ def main():
     print("Creating cloudscraper session...")
     # cloudscraper uses requests under the hood; can pass verify via .get(verify=...) or override session.verify
     scraper = cloudscraper.create_scraper(browser={"custom": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0 Safari/537.36"})
+    # one pooled connection per worker so concurrent downloads reuse TCP/TLS
+    size_pool(scraper, max(args.workers, POOL_SIZE))
     if args.insecure:
         scraper.verify = False
         import urllib3
@@ -72,23 +191,18 @@ def main():
     imgs = [u for u in imgs if urlparse(u).netloc == parsed.netloc]
     print("After same-origin filter:", len(imgs))
 
-    for u in tqdm(imgs):
-        fname = sanitize(u)
-        dest = os.path.join(outdir, fname)
-        if os.path.exists(dest):
-            continue
-        try:
-            rr = scraper.get(u, timeout=30, stream=True)
-            if rr.status_code == 200 and rr.headers.get("content-type","").startswith("image"):
-                with open(dest, "wb") as f:
-                    for chunk in rr.iter_content(8192):
-                        if chunk:
-                            f.write(chunk)
-                time.sleep(SLEEP)
-            else:
-                print("Skipping non-image or bad status for", u, rr.status_code, rr.headers.get("content-type"))
-        except Exception as e:
-            print("Download error for", u, e)
+    # one directory listing instead of a stat() per candidate
+    existing = set(os.listdir(outdir))
+    validators = load_validators(outdir)
+    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+        # only urls not on disk yet are probed; saved files go straight to
+        # the conditional GET
+        fresh = [u for u in imgs if sanitize(u) not in existing]
+        is_image = dict(zip(fresh, ex.map(partial(probe_image, scraper), fresh)))
+        imgs = [u for u in imgs if is_image.get(u, True)]
+        print("After HEAD check:", len(imgs))
+        list(tqdm(ex.map(partial(download_one, scraper, outdir=outdir, existing=existing, validators=validators, refresh=args.refresh), imgs), total=len(imgs)))
+    save_validators(outdir, validators)
 
     print("Done. images saved to", os.path.abspath(outdir))
 
@@ -14,6 +14,7 @@ classify("車輛用油")
 classify("vehicular oil")  # if you add synonyms below
 """
 
+from functools import lru_cache
 from typing import Dict, Optional
 
 # Canonical categories and their CPC links / ids
@@ -45,7 +46,7 @@ CPC_CATEGORIES: Dict[str, Dict[str, str]] = {
     },
 }
 
-# Optional synonyms mapping to canonical keys (extend as needed)
+# Optional synonyms mapping to canonical keys (extend as needed; read once at import)
 SYNONYMS: Dict[str, str] = {
     # Chinese variants
     "車用機油": "車輛用油",
@@ -59,6 +60,16 @@ SYNONYMS: Dict[str, str] = {
 }
 
 
+# Lowercased name -> canonical key, built once at import time.
+# Synonyms are added last so they win over canonical names, as before.
+_LOOKUP: Dict[str, str] = {}
+for _canon in CPC_CATEGORIES:
+    _LOOKUP[_canon.lower()] = _canon
+for _syn, _canon in SYNONYMS.items():
+    _LOOKUP[_syn.lower()] = _canon
+
+
+@lru_cache(maxsize=1024)
 def normalize_name(name: str) -> str:
     """
     Normalize input name to the canonical category key.
@@ -71,19 +82,8 @@ def normalize_name(name: str) -> str:
     if not name:
         return ""
     key = name.strip()
-    lower = key.lower()
-    # match synonyms by lowercased keys
-    for syn, canon in SYNONYMS.items():
-        if syn.lower() == lower:
-            return canon
-    # direct canonical match
-    for canon in CPC_CATEGORIES.keys():
-        if canon == key:
-            return canon
-        if canon.lower() == lower:
-            return canon
     # fallback: return stripped original (caller may handle)
-    return key
+    return _LOOKUP.get(key.lower(), key)
 
 
 def classify(name: str) -> Optional[Dict[str, str]]: